@@ -2,15 +2,28 @@
 # CHQ: Gemini AI generated this
 
 import os
-from flask import Flask, request, jsonify, send_from_directory
+import atexit
+import logging
+from typing import Annotated
+import msgspec
+import orjson
+from flask import Flask, request, send_from_directory
 from flask_cors import CORS
+from flask_caching import Cache
 import psycopg2
+from psycopg2.extras import RealDictCursor, execute_values
 from dotenv import load_dotenv
 from urllib.parse import urlparse
+from db import Database, DB_CONNECTION_ERRORS
+from json_responses import json_response, error_response
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Log through the standard logging module; LOG_LEVEL=DEBUG shows more detail
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
+log = logging.getLogger(__name__)
+
 app = Flask(__name__)
 
 # Configure CORS to allow requests from your React app
@@ -20,143 +33,211 @@ app = Flask(__name__)
 # CORS(app, resources={r"/myapi/*": {"origins": ["http://localhost:5173","http://localhost:5174"]}})
 CORS(app, resources={r"/myapi/*": {"origins": ["http://localhost:5173", "https://studentfrontendreact.vercel.app"]}})
 
-
-# --- Database Connection ---
-def get_db_connection():
-    conn = None
-    try:
-        # Parse the DATABASE_URL from environment variables
-        db_url = os.environ.get('DATABASE_URL')
-        if not db_url:
-            raise ValueError("DATABASE_URL environment variable is not set.")
-
-        url = urlparse(db_url)
-        conn = psycopg2.connect(
-            host=url.hostname,
-            database=url.path[1:],  # Remove leading slash from path
-            user=url.username,
-            password=url.password,
-            port=url.port if url.port else 5432, # Default PostgreSQL port if not specified
-            sslmode='require' # Neon requires SSL
-        )
-        print("Successfully connected to PostgreSQL database!") # For initial testing, you can leave this.
-        return conn
-    except Exception as e:
-        print(f"Error connecting to database: {e}")
-        return None
+# --- Response Cache ---
+# Student reads are served from an in-process cache and cleared by every write
+# endpoint. With several Gunicorn workers, set CACHE_TYPE=RedisCache and
+# CACHE_REDIS_URL so all workers share (and invalidate) the same cache.
+STUDENTS_CACHE_TIMEOUT = 30
+STUDENTS_CACHE_KEY = 'students:all'
+
+cache = Cache(app, config={
+    "CACHE_TYPE": os.environ.get('CACHE_TYPE', 'SimpleCache'),
+    "CACHE_REDIS_URL": os.environ.get('CACHE_REDIS_URL'),
+    "CACHE_DEFAULT_TIMEOUT": STUDENTS_CACHE_TIMEOUT,
+})
+
+def student_cache_key(student_id):
+    return f'student:{student_id}'
+
+def is_cacheable(response):
+    # Only successful responses are cached; errors are retried against the database
+    return getattr(response, 'status_code', None) == 200
+
+def invalidate_student_cache(student_id=None):
+    cache.delete(STUDENTS_CACHE_KEY)
+    if student_id is not None:
+        cache.delete(student_cache_key(student_id))
+
+
+# Columns returned for a student, already shaped like the API's JSON: Postgres
+# formats enrollment_date, so rows (fetched as dicts) are serialized unchanged.
+STUDENT_COLUMNS = "id, first_name, last_name, email, major, to_char(enrollment_date, 'YYYY-MM-DD') AS enrollment_date"
+
+# --- Prepared Statements ---
+# The hottest queries are PREPAREd once per pooled connection (see db.py).
+# DATABASE_URL must therefore point at a direct connection, not a
+# transaction-mode PgBouncer (Neon "-pooler") endpoint.
+PREPARED_STATEMENTS = {
+    'select_student': f'SELECT {STUDENT_COLUMNS} FROM students WHERE id = $1',
+    'insert_student': (
+        'INSERT INTO students (first_name, last_name, email, major) VALUES ($1, $2, $3, $4) '
+        f'ON CONFLICT (email) DO NOTHING RETURNING {STUDENT_COLUMNS}'
+    ),
+    'delete_student': 'DELETE FROM students WHERE id = $1 RETURNING id',
+}
+
+# Parse the DATABASE_URL once at startup; the app cannot serve anything without it
+DATABASE_URL = os.environ.get('DATABASE_URL')
+if not DATABASE_URL:
+    raise EnvironmentError("DATABASE_URL environment variable is not set.")
+
+_db_url = urlparse(DATABASE_URL)
+DB_CONNECT_KWARGS = dict(
+    host=_db_url.hostname,
+    database=_db_url.path[1:],  # Remove leading slash from path
+    user=_db_url.username,
+    password=_db_url.password,
+    port=_db_url.port if _db_url.port else 5432, # Default PostgreSQL port if not specified
+    sslmode='require' # Neon requires SSL
+)
+
+# --- Database Connection Pool ---
+# Every cursor returns rows as dicts, ready for orjson
+db = Database(prepared_statements=PREPARED_STATEMENTS, cursor_factory=RealDictCursor, **DB_CONNECT_KWARGS)
+get_db_connection = db.connection
+
+db.open()
+atexit.register(db.close)
 
 # --- API Endpoints for Students ---
 
+ERR_DB_CONNECTION_FAILED = orjson.dumps({"error": "Database connection failed"})
+ERR_INTERNAL = orjson.dumps({"error": "Internal server error"})
+ERR_STUDENT_NOT_FOUND = orjson.dumps({"error": "Student not found"})
+ERR_STUDENT_NOT_CHANGED = orjson.dumps({"error": "Student not found or no changes applied."})
+ERR_EMAIL_EXISTS = orjson.dumps({"error": "Email already exists."})
+ERR_EMAIL_TAKEN = orjson.dumps({"error": "Email already exists for another student."})
+ERR_EXPECTED_STUDENT_LIST = orjson.dumps({"error": "Expected a non-empty JSON array of students."})
+ERR_NO_UPDATE_DATA = orjson.dumps({"error": "No data provided for update."})
+ERR_NO_VALID_UPDATE_FIELDS = orjson.dumps({"error": "No valid fields provided for update."})
+ERR_EXPECTED_UPDATE_OBJECT = orjson.dumps({"error": "Expected a JSON object of fields to update."})
+
+# Request bodies are parsed and validated in a single pass by msgspec
+NonEmptyStr = Annotated[str, msgspec.Meta(min_length=1)]
+
+class StudentIn(msgspec.Struct):
+    """A student as sent to POST/PUT /myapi/students and /myapi/students/bulk."""
+    first_name: NonEmptyStr
+    last_name: NonEmptyStr
+    email: NonEmptyStr
+    major: str | None = None
+
+def invalid_body_response(e):
+    # msgspec's message names the offending field, e.g. "... - at `$[2].email`"
+    return json_response({"error": str(e)}, 400)
+
+# GET /myapi/students reads rows from a server-side cursor in batches of this size
+STUDENTS_FETCH_BATCH_SIZE = 1000
+# POST /myapi/students/bulk sends this many rows per INSERT statement
+STUDENTS_INSERT_BATCH_SIZE = 500
+
 # GET all students
 @app.route('/myapi/students', methods=['GET'])
+@cache.cached(key_prefix=STUDENTS_CACHE_KEY, response_filter=is_cacheable)
 def get_students():
-    conn = None
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({"error": "Database connection failed"}), 500
-
-        cur = conn.cursor()
-        cur.execute('SELECT id, first_name, last_name, email, major, enrollment_date FROM students ORDER BY id ASC')
-        students = cur.fetchall()
-        cur.close()
-
-        students_list = []
-        for student in students:
-            students_list.append({
-                "id": student[0],
-                "first_name": student[1],
-                "last_name": student[2],
-                "email": student[3],
-                "major": student[4],
-                "enrollment_date": student[5].isoformat() # Convert date object to ISO string
-            })
-        return jsonify(students_list)
-    except Exception as e:
-        print(f"Error fetching students: {e}")
-        return jsonify({"error": "Internal server error"}), 500
-    finally:
-        if conn:
-            conn.close()
+        # A named (server-side) cursor hands rows over in batches rather than
+        # materializing the whole table in libpq first.
+        with get_db_connection() as conn, \
+                conn.cursor(name='students_stream') as cur:
+            cur.itersize = STUDENTS_FETCH_BATCH_SIZE
+            cur.execute(f'SELECT {STUDENT_COLUMNS} FROM students ORDER BY id ASC')
+            students = list(cur)
+
+        return json_response(students)
+    except DB_CONNECTION_ERRORS:
+        log.exception("Error connecting to database")
+        return error_response(ERR_DB_CONNECTION_FAILED, 500)
+    except Exception:
+        log.exception("Error fetching students")
+        return error_response(ERR_INTERNAL, 500)
 
 # GET a single student by ID
 @app.route('/myapi/students/<int:student_id>', methods=['GET'])
+@cache.cached(make_cache_key=student_cache_key, response_filter=is_cacheable)
 def get_student(student_id):
-    conn = None
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({"error": "Database connection failed"}), 500
-
-        cur = conn.cursor()
-        cur.execute('SELECT id, first_name, last_name, email, major, enrollment_date FROM students WHERE id = %s', (student_id,))
-        student = cur.fetchone()
-        cur.close()
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute('EXECUTE select_student (%s)', (student_id,))
+            student = cur.fetchone()
+
         if student is None:
-            return jsonify({"error": "Student not found"}), 404
-
-        student_data = {
-            "id": student[0],
-            "first_name": student[1],
-            "last_name": student[2],
-            "email": student[3],
-            "major": student[4],
-            "enrollment_date": student[5].isoformat()
-        }
-        return jsonify(student_data)
-    except Exception as e:
-        print(f"Error fetching student: {e}")
-        return jsonify({"error": "Internal server error"}), 500
-    finally:
-        if conn:
-            conn.close()
+            return error_response(ERR_STUDENT_NOT_FOUND, 404)
+
+        return json_response(student)
+    except DB_CONNECTION_ERRORS:
+        log.exception("Error connecting to database")
+        return error_response(ERR_DB_CONNECTION_FAILED, 500)
+    except Exception:
+        log.exception("Error fetching student")
+        return error_response(ERR_INTERNAL, 500)
 
 # POST a new student
 @app.route('/myapi/students', methods=['POST'])
 def add_student():
-    data = request.get_json()
-    first_name = data.get('first_name')
-    last_name = data.get('last_name')
-    email = data.get('email')
-    major = data.get('major')
+    try:
+        student = msgspec.json.decode(request.get_data(), type=StudentIn)
+    except msgspec.DecodeError as e:
+        return invalid_body_response(e)
+
+    try:
+        # A duplicate email inserts nothing (and returns no row) instead of
+        # raising, so the transaction is never aborted and needs no rollback.
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                'EXECUTE insert_student (%s, %s, %s, %s)',
+                (student.first_name, student.last_name, student.email, student.major)
+            )
+            new_student = cur.fetchone()
+
+        if new_student is None:
+            return error_response(ERR_EMAIL_EXISTS, 409)
+        invalidate_student_cache()
+
+        return json_response(new_student, 201)
+    except DB_CONNECTION_ERRORS:
+        log.exception("Error connecting to database")
+        return error_response(ERR_DB_CONNECTION_FAILED, 500)
+    except Exception:
+        log.exception("Error adding student")
+        return error_response(ERR_INTERNAL, 500)
+
+
+# POST many students at once (e.g. an admin import)
+@app.route('/myapi/students/bulk', methods=['POST'])
+def add_students_bulk():
+    try:
+        students = msgspec.json.decode(request.get_data(), type=list[StudentIn])
+    except msgspec.DecodeError as e:
+        return invalid_body_response(e)
+    if not students:
+        return error_response(ERR_EXPECTED_STUDENT_LIST, 400)
 
-    if not all([first_name, last_name, email]):
-        return jsonify({"error": "First name, last name, and email are required."}), 400
+    rows = [(s.first_name, s.last_name, s.email, s.major) for s in students]
 
-    conn = None
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({"error": "Database connection failed"}), 500
-
-        cur = conn.cursor()
-        cur.execute(
-            'INSERT INTO students (first_name, last_name, email, major) VALUES (%s, %s, %s, %s) RETURNING *',
-            (first_name, last_name, email, major)
-        )
-        new_student = cur.fetchone()
-        conn.commit() # Commit the transaction
-        cur.close()
-
-        new_student_data = {
-            "id": new_student[0],
-            "first_name": new_student[1],
-            "last_name": new_student[2],
-            "email": new_student[3],
-            "major": new_student[4],
-            "enrollment_date": new_student[5].isoformat()
-        }
-        return jsonify(new_student_data), 201
-    except psycopg2.errors.UniqueViolation: # Catch unique constraint violation (e.g., duplicate email)
-        conn.rollback() # Rollback on error
-        return jsonify({"error": "Email already exists."}), 409
-    except Exception as e:
-        conn.rollback() # Rollback on error
-        print(f"Error adding student: {e}")
-        return jsonify({"error": "Internal server error"}), 500
-    finally:
-        if conn:
-            conn.close()
+        # execute_values packs STUDENTS_INSERT_BATCH_SIZE rows into each INSERT,
+        # so N students cost ceil(N / batch size) round trips instead of N.
+        # Students whose email already exists are skipped, not treated as errors.
+        with get_db_connection() as conn, conn.cursor() as cur:
+            created = execute_values(
+                cur,
+                'INSERT INTO students (first_name, last_name, email, major) VALUES %s '
+                f'ON CONFLICT (email) DO NOTHING RETURNING {STUDENT_COLUMNS}',
+                rows,
+                page_size=STUDENTS_INSERT_BATCH_SIZE,
+                fetch=True
+            )
+        if created:
+            invalidate_student_cache()
+
+        return json_response({"created": created, "skipped": len(rows) - len(created)}, 201)
+    except DB_CONNECTION_ERRORS:
+        log.exception("Error connecting to database")
+        return error_response(ERR_DB_CONNECTION_FAILED, 500)
+    except Exception:
+        log.exception("Error adding students in bulk")
+        return error_response(ERR_INTERNAL, 500)
 
 
 # CHQ: Gemini AI generated endpoint for patch
@@ -165,143 +246,128 @@ def add_student():
 def patch_student(student_id):
     data = request.get_json()
     if not data:
-        return jsonify({"error": "No data provided for update."}), 400
+        return error_response(ERR_NO_UPDATE_DATA, 400)
+    if not isinstance(data, dict):
+        return error_response(ERR_EXPECTED_UPDATE_OBJECT, 400)
+
+    # Build dynamic update query based on provided fields
+    set_clauses = []
+    update_values = []
+
+    if 'first_name' in data:
+        set_clauses.append("first_name = %s")
+        update_values.append(data['first_name'])
+    if 'last_name' in data:
+        set_clauses.append("last_name = %s")
+        update_values.append(data['last_name'])
+    if 'email' in data:
+        set_clauses.append("email = %s")
+        update_values.append(data['email'])
+    if 'major' in data:
+        set_clauses.append("major = %s")
+        update_values.append(data['major'])
+    # Add other fields here if you have more that can be updated
+
+    if not set_clauses:
+        return error_response(ERR_NO_VALID_UPDATE_FIELDS, 400)
+
+    # Add student_id to the end of update_values for the WHERE clause
+    update_values.append(student_id)
 
-    conn = None
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({"error": "Database connection failed"}), 500
-
-        cur = conn.cursor()
-
-        # Build dynamic update query based on provided fields
-        set_clauses = []
-        update_values = []
-
-        if 'first_name' in data:
-            set_clauses.append("first_name = %s")
-            update_values.append(data['first_name'])
-        if 'last_name' in data:
-            set_clauses.append("last_name = %s")
-            update_values.append(data['last_name'])
-        if 'email' in data:
-            set_clauses.append("email = %s")
-            update_values.append(data['email'])
-        if 'major' in data:
-            set_clauses.append("major = %s")
-            update_values.append(data['major'])
-        # Add other fields here if you have more that can be updated
-
-        if not set_clauses:
-            return jsonify({"error": "No valid fields provided for update."}), 400
-
-        # Add student_id to the end of update_values for the WHERE clause
-        update_values.append(student_id)
-
-        query = f'UPDATE students SET {", ".join(set_clauses)} WHERE id = %s RETURNING *'
-        cur.execute(query, tuple(update_values))
-        updated_student = cur.fetchone()
-        conn.commit()
-        cur.close()
+        with get_db_connection() as conn, conn.cursor() as cur:
+            query = f'UPDATE students SET {", ".join(set_clauses)} WHERE id = %s RETURNING {STUDENT_COLUMNS}'
+            cur.execute(query, tuple(update_values))
+            updated_student = cur.fetchone()
 
         if updated_student is None:
-            return jsonify({"error": "Student not found or no changes applied."}), 404
-
-        updated_student_data = {
-            "id": updated_student[0],
-            "first_name": updated_student[1],
-            "last_name": updated_student[2],
-            "email": updated_student[3],
-            "major": updated_student[4],
-            "enrollment_date": updated_student[5].isoformat()
-        }
-        return jsonify(updated_student_data)
+            return error_response(ERR_STUDENT_NOT_CHANGED, 404)
+        invalidate_student_cache(student_id)
+
+        return json_response(updated_student)
     except psycopg2.errors.UniqueViolation:
-        conn.rollback()
-        return jsonify({"error": "Email already exists for another student."}), 409
-    except Exception as e:
-        conn.rollback()
-        print(f"Error patching student: {e}")
-        return jsonify({"error": "Internal server error"}), 500
-    finally:
-        if conn:
-            conn.close()
+        return error_response(ERR_EMAIL_TAKEN, 409)
+    except DB_CONNECTION_ERRORS:
+        log.exception("Error connecting to database")
+        return error_response(ERR_DB_CONNECTION_FAILED, 500)
+    except Exception:
+        log.exception("Error patching student")
+        return error_response(ERR_INTERNAL, 500)
 
 
 # PUT (Update) a student
 @app.route('/myapi/students/<int:student_id>', methods=['PUT'])
 def update_student(student_id):
-    data = request.get_json()
-    first_name = data.get('first_name')
-    last_name = data.get('last_name')
-    email = data.get('email')
-    major = data.get('major')
-
-    conn = None
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({"error": "Database connection failed"}), 500
-
-        cur = conn.cursor()
-        cur.execute(
-            'UPDATE students SET first_name = %s, last_name = %s, email = %s, major = %s WHERE id = %s RETURNING *',
-            (first_name, last_name, email, major, student_id)
-        )
-        updated_student = cur.fetchone()
-        conn.commit()
-        cur.close()
+        student = msgspec.json.decode(request.get_data(), type=StudentIn)
+    except msgspec.DecodeError as e:
+        return invalid_body_response(e)
 
-        if updated_student is None:
-            return jsonify({"error": "Student not found"}), 404
-
-        updated_student_data = {
-            "id": updated_student[0],
-            "first_name": updated_student[1],
-            "last_name": updated_student[2],
-            "email": updated_student[3],
-            "major": updated_student[4],
-            "enrollment_date": updated_student[5].isoformat()
-        }
-        return jsonify(updated_student_data)
-    except psycopg2.errors.UniqueViolation:
-        conn.rollback()
-        return jsonify({"error": "Email already exists for another student."}), 409
-    except Exception as e:
-        conn.rollback()
-        print(f"Error updating student: {e}")
-        return jsonify({"error": "Internal server error"}), 500
-    finally:
-        if conn:
-            conn.close()
+    try:
+        # Checks that the student exists and that no other student has the email
+        # in the same statement as the update, so a duplicate is reported without
+        # aborting the transaction. Always returns one row: the 'found' and
+        # 'taken' flags plus the updated student's columns (all NULL when nothing
+        # was updated).
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                f"""
+                WITH checks AS (
+                    SELECT EXISTS (
+                        SELECT 1 FROM students WHERE id = %(student_id)s
+                    ) AS found, EXISTS (
+                        SELECT 1 FROM students WHERE email = %(email)s AND id <> %(student_id)s
+                    ) AS taken
+                ), updated AS (
+                    UPDATE students
+                    SET first_name = %(first_name)s, last_name = %(last_name)s, email = %(email)s, major = %(major)s
+                    WHERE id = %(student_id)s AND NOT (SELECT taken FROM checks)
+                    RETURNING {STUDENT_COLUMNS}
+                )
+                SELECT checks.found, checks.taken, updated.* FROM checks LEFT JOIN updated ON true
+                """,
+                {**msgspec.structs.asdict(student), "student_id": student_id}
+            )
+            updated_student = cur.fetchone()
+
+        # A missing student is reported before a taken email
+        if not updated_student.pop('found'):
+            return error_response(ERR_STUDENT_NOT_FOUND, 404)
+        if updated_student.pop('taken'):
+            return error_response(ERR_EMAIL_TAKEN, 409)
+        if updated_student['id'] is None: # Deleted between the check and the update
+            return error_response(ERR_STUDENT_NOT_FOUND, 404)
+        invalidate_student_cache(student_id)
+
+        return json_response(updated_student)
+    except psycopg2.errors.UniqueViolation: # Another request took the email between the check and the update
+        return error_response(ERR_EMAIL_TAKEN, 409)
+    except DB_CONNECTION_ERRORS:
+        log.exception("Error connecting to database")
+        return error_response(ERR_DB_CONNECTION_FAILED, 500)
+    except Exception:
+        log.exception("Error updating student")
+        return error_response(ERR_INTERNAL, 500)
 
 # DELETE a student
 @app.route('/myapi/students/<int:student_id>', methods=['DELETE'])
 def delete_student(student_id):
-    conn = None
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({"error": "Database connection failed"}), 500
-
-        cur = conn.cursor()
-        cur.execute('DELETE FROM students WHERE id = %s RETURNING *', (student_id,))
-        deleted_student = cur.fetchone()
-        conn.commit()
-        cur.close()
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute('EXECUTE delete_student (%s)', (student_id,))
+            deleted_student = cur.fetchone()
 
         if deleted_student is None:
-            return jsonify({"error": "Student not found"}), 404
+            return error_response(ERR_STUDENT_NOT_FOUND, 404)
+        invalidate_student_cache(student_id)
 
-        return jsonify({"message": "Student deleted successfully", "deleted_id": deleted_student[0]})
-    except Exception as e:
-        conn.rollback()
-        print(f"Error deleting student: {e}")
-        return jsonify({"error": "Internal server error"}), 500
-    finally:
-        if conn:
-            conn.close()
+        return json_response({"message": "Student deleted successfully", "deleted_id": deleted_student['id']})
+    except DB_CONNECTION_ERRORS:
+        log.exception("Error connecting to database")
+        return error_response(ERR_DB_CONNECTION_FAILED, 500)
+    except Exception:
+        log.exception("Error deleting student")
+        return error_response(ERR_INTERNAL, 500)
 
 # Basic route to check if the server is running
 @app.route('/')
@@ -324,6 +390,18 @@ def health_check():
     return "OK", 200
 
 
+# --- Gunicorn Worker Lifecycle ---
+# With preload_app, Gunicorn imports this module once in the master and forks
+# the workers from it. Database connections must not be shared between
+# processes, so the master's pool is closed before forking and every worker
+# opens its own (see gunicorn.conf.py).
+def before_fork():
+    db.close()
+
+def after_fork():
+    db.open()
+
+
 if __name__ == '__main__':
     # Flask will automatically use the FLASK_APP and FLASK_ENV from .env
     # when run with 'flask run'. For direct execution, you can specify port.
@@ -0,0 +1,149 @@
+# db.py
+# Postgres connection pooling shared by app.py and descope_auth_test.py.
+
+import logging
+import os
+import select
+import threading
+import time
+from contextlib import contextmanager
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+
+log = logging.getLogger(__name__)
+
+# --- Database Connection Pool ---
+# Opening a connection to Neon costs a full TCP + TLS + auth handshake, so
+# connections are opened once per process and reused across requests.
+POOL_MIN_CONNECTIONS = 2
+POOL_MAX_CONNECTIONS = int(os.environ.get('PG_POOL_MAX', '10'))
+POOL_TIMEOUT_SECONDS = 10
+# TCP keepalives keep NAT/proxies from dropping idle pooled connections. They do
+# not stop the server from closing them (Neon suspends idle computes; backends
+# can be terminated), so connections are also checked when borrowed.
+POOL_KEEPALIVE_KWARGS = dict(keepalives=1, keepalives_idle=30)
+# Connections idle longer than this are pinged before use
+POOL_IDLE_CHECK_SECONDS = 30
+
+# Errors meaning the database could not be reached (as opposed to a bad query)
+DB_CONNECTION_ERRORS = (psycopg2.OperationalError, PoolError)
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """A connection that remembers whether its prepared statements exist yet."""
+    statements_prepared = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.returned_at = time.monotonic() # When it was opened or last handed back to the pool
+
+def is_usable(conn):
+    """Checks a connection just taken from the pool, before a request relies on it."""
+    if conn.closed:
+        return False
+    # Between requests a healthy connection has nothing to read; waiting data
+    # usually means the server closed it (a FATAL message or EOF). Checking
+    # costs no round trip, so recently used connections are trusted on it.
+    idle = time.monotonic() - conn.returned_at
+    if idle < POOL_IDLE_CHECK_SECONDS and not select.select([conn], [], [], 0)[0]:
+        return True
+    # Readable or long idle (possibly dropped without the socket noticing): ping it
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        return False
+
+class Database:
+    """
+    A process's pool of Postgres connections. The arguments are passed on to
+    psycopg2.connect. prepared_statements maps names to queries that are
+    PREPAREd once per pooled connection, so Postgres parses and plans them once
+    and each request only sends EXECUTE with its parameters. PREPARE is per
+    session: the database URL must point at a direct connection, not a
+    transaction-mode PgBouncer (Neon "-pooler") endpoint.
+    """
+
+    def __init__(self, *dsn, prepared_statements=None, **connect_kwargs):
+        self.dsn = dsn
+        self.connect_kwargs = connect_kwargs
+        self.prepared_statements = prepared_statements or {}
+        self.pool = None
+        # ThreadedConnectionPool raises as soon as it is exhausted; this semaphore makes
+        # callers wait (up to POOL_TIMEOUT_SECONDS) for a connection to be returned.
+        self._slots = threading.BoundedSemaphore(POOL_MAX_CONNECTIONS)
+
+    def open(self):
+        """Opens this process's connection pool; pool stays None if the database is unreachable."""
+        try:
+            self.pool = ThreadedConnectionPool(
+                POOL_MIN_CONNECTIONS,
+                POOL_MAX_CONNECTIONS,
+                *self.dsn,
+                connection_factory=PreparingConnection,
+                **self.connect_kwargs,
+                **POOL_KEEPALIVE_KWARGS
+            )
+            log.info("Successfully connected to PostgreSQL database!")
+        except Exception:
+            log.exception("Error connecting to database")
+            self.pool = None
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.closeall()
+            self.pool = None
+
+    def _getconn(self):
+        # Dead connections are discarded until a usable one (possibly a freshly
+        # opened one) comes out of the pool
+        for _ in range(POOL_MAX_CONNECTIONS):
+            conn = self.pool.getconn()
+            if is_usable(conn):
+                return conn
+            log.info("Discarding a pooled database connection closed by the server")
+            self.pool.putconn(conn, close=True)
+        return self.pool.getconn()
+
+    def prepare_statements(self, conn):
+        with conn.cursor() as cur:
+            for name, query in self.prepared_statements.items():
+                cur.execute(f'PREPARE {name} AS {query}')
+        conn.statements_prepared = True
+
+    @contextmanager
+    def connection(self, prepare=True):
+        """
+        Borrows a pooled connection for the duration of a `with` block.
+        Commits when the block succeeds, rolls back when it raises, and always
+        hands the connection back to the pool. Unless prepare is False, the
+        connection's prepared statements are created on its first use.
+        """
+        if self.pool is None:
+            raise PoolError("Database connection pool is not available.")
+        if not self._slots.acquire(timeout=POOL_TIMEOUT_SECONDS):
+            raise PoolError("Timed out waiting for a database connection.")
+        try:
+            conn = self._getconn()
+            try:
+                if prepare and not conn.statements_prepared:
+                    try:
+                        self.prepare_statements(conn)
+                    except Exception:
+                        # PREPARE is not transactional: statements created before
+                        # the failure survive the rollback and would collide on the
+                        # next attempt, so the connection is discarded instead.
+                        conn.close()
+                        raise
+                yield conn
+                conn.commit()
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+            finally:
+                # Connections dropped by the server are discarded rather than reused
+                conn.returned_at = time.monotonic()
+                self.pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            self._slots.release()
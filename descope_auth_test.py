@@ -5,20 +5,33 @@
 # and production environments.
 # -------------------------------------------------------------------------------------------------------------------
 
-from flask import Flask, request, jsonify, make_response
+from flask import Flask, request
+from flask_cors import CORS
 import os
+import atexit
+import logging
+import base64
+import hashlib
+import hmac
+import re
+import threading
+import time
 import jwt
-import psycopg2
-from datetime import datetime, timedelta
-
-# Corrected imports
-from descope import DescopeClient
-from descope.exceptions import DescopeException
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+from db import Database
+from json_responses import json_response, error_response
 
 # Load environment variables from .env file
 from dotenv import load_dotenv
 load_dotenv()
 
+# Log through the standard logging module; LOG_LEVEL=DEBUG shows more detail
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
+log = logging.getLogger(__name__)
+
 # --- Application Configuration ---
 app = Flask(__name__)
 # Get environment variables
@@ -26,136 +39,358 @@ NEON_DB_URL = os.environ.get('NEON_DB_URL')
 # We now use a comma-separated list for allowed origins
 ALLOWED_ORIGINS_STR = os.environ.get('ALLOWED_ORIGINS')
 DESCOPE_PROJECT_ID = os.environ.get('DESCOPE_PROJECT_ID')
-DESCOPE_ACCESS_KEY = os.environ.get('DESCOPE_ACCESS_KEY')
 APP_SECRET_KEY = os.environ.get('APP_SECRET_KEY')
 
 # Check if all required environment variables are set
-if not all([NEON_DB_URL, ALLOWED_ORIGINS_STR, DESCOPE_PROJECT_ID, DESCOPE_ACCESS_KEY, APP_SECRET_KEY]):
+if not all([NEON_DB_URL, ALLOWED_ORIGINS_STR, DESCOPE_PROJECT_ID, APP_SECRET_KEY]):
     raise EnvironmentError("One or more required environment variables are missing. Please check your .env file.")
 
 # Parse the comma-separated string into a list of allowed origins
 ALLOWED_ORIGINS = [origin.strip() for origin in ALLOWED_ORIGINS_STR.split(',')]
 
-# Initialize the Descope client
-try:
-    descope_client = DescopeClient(project_id=DESCOPE_PROJECT_ID, management_key=DESCOPE_ACCESS_KEY)
-except DescopeException as e:
-    print(f"Failed to initialize DescopeClient: {e}")
-    descope_client = None
-
-# --- Helper function to get the allowed origin for the current request ---
-# This is crucial for handling multiple origins correctly in the headers.
-def get_request_origin():
+# --- CORS (multiple origins) ---
+# Flask-CORS answers preflight OPTIONS requests and adds the Access-Control-*
+# headers to every /api/* response whose Origin is in ALLOWED_ORIGINS.
+# Credentials are allowed so the browser sends and stores the session cookie.
+CORS(app, resources={r"/api/*": {
+    "origins": ALLOWED_ORIGINS,
+    "supports_credentials": True,
+    "allow_headers": ["Content-Type", "Authorization"],
+    "methods": ["GET", "POST", "OPTIONS"],
+}})
+
+# --- Database Connection Pool ---
+# Connections to Neon are opened once per process and reused (see db.py), so a
+# login does not pay a fresh TCP + TLS + auth handshake.
+
+# The login UPSERT is PREPAREd once per pooled connection. NEON_DB_URL must
+# therefore point at a direct connection, not a transaction-mode PgBouncer
+# (Neon "-pooler") endpoint.
+PREPARED_STATEMENTS = {
+    # Create the user on first login, otherwise record the login and pick up
+    # any email/name change (keeping the old name if the token has none)
+    'upsert_user': (
+        'INSERT INTO users (descope_user_id, email, name) VALUES ($1, $2, $3) '
+        'ON CONFLICT (descope_user_id) DO UPDATE SET '
+        'last_login_at = CURRENT_TIMESTAMP, email = EXCLUDED.email, name = COALESCE(EXCLUDED.name, users.name)'
+    ),
+}
+
+db = Database(NEON_DB_URL, prepared_statements=PREPARED_STATEMENTS)
+get_db_connection = db.connection
+
+db.open()
+atexit.register(db.close)
+
+# --- JWT Decoding ---
+# PyJWT parses claims with the stdlib json module; this decoder overrides its
+# payload hook to parse them with orjson instead.
+class OrjsonPyJWT(jwt.PyJWT):
+    def _decode_payload(self, decoded):
+        try:
+            payload = orjson.loads(decoded['payload'])
+        except orjson.JSONDecodeError as e:
+            raise jwt.DecodeError(f"Invalid payload string: {e}") from e
+        if not isinstance(payload, dict):
+            raise jwt.DecodeError("Invalid payload string: must be a json object")
+        return payload
+
+jwt_decoder = OrjsonPyJWT()
+
+# Decode arguments are built once rather than as fresh literals on every call
+DESCOPE_JWT_ALGORITHMS = ('RS256',)
+DESCOPE_JWT_OPTIONS = {"require": ["exp", "sub", "aud", "iss"], "verify_aud": True}
+SESSION_JWT_ALGORITHMS = ('HS256',)
+SESSION_JWT_OPTIONS = {"require": ["exp", "sub"]}
+
+# --- Descope JWKS Cache ---
+# Session tokens are verified locally against Descope's published signing keys,
+# so a login does not wait on a round trip to Descope. A background thread
+# re-fetches the keys shortly before the response's Cache-Control max-age runs
+# out, revalidating with ETag / Last-Modified so unchanged keys cost a 304. If
+# Descope is unreachable the previous keys keep being served. A token naming a
+# key id we have not seen (Descope rotated its keys) also triggers a refetch.
+DESCOPE_JWKS_URL = f"https://api.descope.com/{DESCOPE_PROJECT_ID}/.well-known/jwks.json"
+JWKS_DEFAULT_MAX_AGE_SECONDS = 3600 # Used when Descope sends no Cache-Control max-age
+JWKS_REFRESH_MARGIN_SECONDS = 60 # Background refresh runs this long before expiry
+JWKS_MIN_REFRESH_SECONDS = 60 # Refetches (background retries, inline fetches) happen at most this often
+JWKS_HTTP_TIMEOUT_SECONDS = 2 # A slow Descope must not hold an unknown-kid login for long
+_MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+_jwks_cache = {} # kid -> public key object, built once per fetch
+_jwks_fetched_at = float('-inf') # Never
+_jwks_max_age = JWKS_DEFAULT_MAX_AGE_SECONDS
+_jwks_etag = None
+_jwks_last_modified = None
+_jwks_forced_at = float('-inf')
+_jwks_lock = threading.Lock()
+_jwks_refresher = None
+_jwks_stop = threading.Event()
+
+def _new_http_session(retries):
+    # A keep-alive session, so fetches reuse the TLS connection to api.descope.com
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=2, max_retries=retries))
+    return session
+
+# A login that fetches inline makes a single attempt, so an unreachable Descope
+# costs it at most one JWKS_HTTP_TIMEOUT_SECONDS. Nobody waits on the background
+# refresher, so its connection errors and 502/503/504s are retried with a short backoff.
+JWKS_BACKGROUND_RETRY = Retry(total=3, backoff_factor=0.1, status_forcelist=[502, 503, 504])
+_http = _new_http_session(0)
+_http_background = _new_http_session(JWKS_BACKGROUND_RETRY)
+
+def _load_signing_keys(jwks):
+    """
+    Returns {kid: public key object} for the JWKS entries that can verify
+    Descope session tokens. Like PyJWKSet, entries that are not usable (no
+    'kid', an encryption key, another algorithm, unparseable) are skipped.
+    Raises jwt.PyJWKSetError if none are left.
+    """
+    jwk_list = jwks.get('keys') if isinstance(jwks, dict) else None
+    if not isinstance(jwk_list, list):
+        raise jwt.PyJWKSetError("Invalid JWK Set value")
+    keys = {}
+    for jwk in jwk_list:
+        if not isinstance(jwk, dict) or not isinstance(jwk.get('kid'), str):
+            continue
+        if jwk.get('use', 'sig') != 'sig':
+            continue
+        try:
+            # Parsed here, once, not on every verification. PyJWK loads the
+            # key through the 'cryptography' (OpenSSL) backend.
+            parsed = jwt.PyJWK(jwk)
+        except (jwt.PyJWTError, ValueError) as e: # Bad key material can surface as a plain ValueError
+            log.warning("Skipping unusable JWKS key %r: %s", jwk['kid'], e)
+            continue
+        if parsed.algorithm_name in DESCOPE_JWT_ALGORITHMS:
+            keys[jwk['kid']] = parsed.key
+    if not keys:
+        raise jwt.PyJWKSetError("The JWK Set did not contain any usable signing keys")
+    return keys
+
+# A failed fetch leaves the cached keys in place
+JWKS_FETCH_ERRORS = (requests.RequestException, jwt.PyJWKSetError)
+
+def fetch_jwks(background=False):
+    """
+    Fetches Descope's JWKS, conditionally when we already hold a copy, and
+    swaps it into the cache. Raises one of JWKS_FETCH_ERRORS on failure.
+    Only background fetches are retried.
+    """
+    global _jwks_cache, _jwks_fetched_at, _jwks_max_age, _jwks_etag, _jwks_last_modified
+    headers = {}
+    if _jwks_cache and _jwks_etag:
+        headers['If-None-Match'] = _jwks_etag
+    if _jwks_cache and _jwks_last_modified:
+        headers['If-Modified-Since'] = _jwks_last_modified
+
+    # The request runs outside the lock so verifications keep using the current keys
+    session = _http_background if background else _http
+    response = session.get(DESCOPE_JWKS_URL, headers=headers, timeout=JWKS_HTTP_TIMEOUT_SECONDS)
+    if response.status_code != 304:
+        response.raise_for_status()
+        keys = _load_signing_keys(response.json())
+    max_age = _MAX_AGE_RE.search(response.headers.get('Cache-Control', ''))
+
+    with _jwks_lock:
+        if response.status_code != 304:
+            _jwks_cache = keys
+            _jwks_etag = response.headers.get('ETag')
+            _jwks_last_modified = response.headers.get('Last-Modified')
+        _jwks_max_age = int(max_age.group(1)) if max_age else JWKS_DEFAULT_MAX_AGE_SECONDS
+        _jwks_fetched_at = time.monotonic()
+
+def _jwks_refresh_delay(minimum):
+    with _jwks_lock:
+        refresh_at = _jwks_fetched_at + _jwks_max_age - JWKS_REFRESH_MARGIN_SECONDS
+    return max(refresh_at - time.monotonic(), minimum)
+
+def _refresh_jwks_forever(stop):
+    # The first pass runs straight away, so the keys are warm before the first
+    # login, unless still-fresh keys were inherited from a preloaded master
+    delay = _jwks_refresh_delay(0) if _jwks_cache else 0
+    while not stop.wait(delay):
+        try:
+            fetch_jwks(background=True)
+        except Exception:
+            # Keep serving the keys we have; the next pass retries
+            log.warning("Background JWKS refresh failed", exc_info=True)
+        delay = _jwks_refresh_delay(JWKS_MIN_REFRESH_SECONDS)
+
+def start_jwks_refresher():
+    global _jwks_refresher, _jwks_stop
+    with _jwks_lock:
+        if _jwks_refresher is None:
+            _jwks_stop = threading.Event()
+            _jwks_refresher = threading.Thread(
+                target=_refresh_jwks_forever, args=(_jwks_stop,), name='jwks-refresher', daemon=True
+            )
+            _jwks_refresher.start()
+
+def stop_jwks_refresher():
+    """Stops the refresher and swaps in unused HTTP sessions, leaving the cached keys in place."""
+    global _jwks_refresher, _http, _http_background
+    with _jwks_lock:
+        refresher, _jwks_refresher = _jwks_refresher, None
+    if refresher is not None:
+        _jwks_stop.set()
+        refresher.join()
+    _http.close()
+    _http_background.close()
+    _http = _new_http_session(0)
+    _http_background = _new_http_session(JWKS_BACKGROUND_RETRY)
+
+def get_jwks(force_refresh=False):
+    """
+    Returns Descope's signing keys as a {kid: public key} dict. The background
+    refresher keeps the cache current; a request only fetches inline while the
+    cache is empty (the startup prefetch has not succeeded yet) or with
+    force_refresh, and at most once per JWKS_MIN_REFRESH_SECONDS. Raises
+    jwt.PyJWKClientConnectionError if no keys are available.
+    """
+    global _jwks_forced_at
+    if force_refresh or not _jwks_cache:
+        with _jwks_lock:
+            now = time.monotonic()
+            allowed = now - max(_jwks_forced_at, _jwks_fetched_at) > JWKS_MIN_REFRESH_SECONDS
+            if allowed:
+                _jwks_forced_at = now
+        if allowed:
+            try:
+                fetch_jwks()
+            except JWKS_FETCH_ERRORS:
+                log.warning("Inline JWKS fetch failed", exc_info=True)
+    if not _jwks_cache:
+        raise jwt.PyJWKClientConnectionError("Descope signing keys are not available.")
+    return _jwks_cache
+
+# Prefetch at startup instead of on the first login
+start_jwks_refresher()
+
+def _split_jwt(token):
+    """Splits a compact JWT into its (header, payload, signature) segments in one pass."""
+    i = token.find('.')
+    j = token.find('.', i + 1)
+    if i < 0 or j < 0:
+        raise jwt.DecodeError("Not enough segments")
+    return token[:i], token[i + 1:j], token[j + 1:]
+
+def _token_kid(token):
+    """Reads the 'kid' from a JWT's header without touching its payload."""
+    if not isinstance(token, str):
+        raise jwt.DecodeError("Invalid token type")
+    header_b64 = _split_jwt(token)[0]
+    try:
+        header = orjson.loads(base64.urlsafe_b64decode(header_b64 + '=' * (-len(header_b64) % 4)))
+    except ValueError as e: # binascii.Error and orjson.JSONDecodeError are both ValueErrors
+        raise jwt.DecodeError("Invalid header padding or JSON") from e
+    if not isinstance(header, dict):
+        raise jwt.DecodeError("Invalid header string: must be a json object")
+    kid = header.get('kid')
+    if kid is not None and not isinstance(kid, str):
+        raise jwt.InvalidTokenError("Key ID header parameter must be a string")
+    return kid
+
+def verify_descope_token(token):
+    """
+    Verifies a Descope session JWT against the cached JWKS and returns its claims.
+    Raises a jwt.PyJWTError if the token is invalid or signed by an unknown key.
+    """
+    # Only the header is read unverified; the claims are decoded exactly once below.
+    kid = _token_kid(token)
+    key = get_jwks().get(kid)
+    if key is None:
+        key = get_jwks(force_refresh=True).get(kid)
+    if key is None:
+        raise jwt.InvalidKeyError(f"No Descope signing key found for kid {kid!r}.")
+
+    return jwt_decoder.decode(
+        token,
+        key,
+        algorithms=DESCOPE_JWT_ALGORITHMS,
+        audience=DESCOPE_PROJECT_ID,
+        options=DESCOPE_JWT_OPTIONS
+    )
+
+# --- Session Tokens ---
+# Our session tokens are always HS256 JWTs with the same header, so the encoded
+# header and the key bytes are prepared once rather than on every login or check.
+SESSION_DURATION_SECONDS = 24 * 60 * 60
+SESSION_TOKEN_HEADER_B64 = base64.urlsafe_b64encode(b'{"alg":"HS256","typ":"JWT"}').rstrip(b'=')
+APP_SECRET_KEY_BYTES = APP_SECRET_KEY.encode()
+
+def encode_session_token(payload):
     """
-    Returns the origin of the current request if it is in the list of ALLOWED_ORIGINS.
-    Returns None otherwise.
+    Returns payload as an HS256 JWT signed with APP_SECRET_KEY (the same token
+    jwt.encode would produce). Claims must already be JSON types, e.g. an
+    integer 'exp'.
     """
-    request_origin = request.headers.get('Origin')
-    if request_origin and request_origin in ALLOWED_ORIGINS:
-        return request_origin
-    return None
+    payload_b64 = base64.urlsafe_b64encode(orjson.dumps(payload)).rstrip(b'=')
+    signing_input = SESSION_TOKEN_HEADER_B64 + b'.' + payload_b64
+    signature = hmac.new(APP_SECRET_KEY_BYTES, signing_input, hashlib.sha256).digest()
+    return (signing_input + b'.' + base64.urlsafe_b64encode(signature).rstrip(b'=')).decode()
 
 # --- Database Initialization ---
-# This function creates the 'users' table if it doesn't already exist.
+# The schema lives in migrations/ and is applied once per release (see README),
+# so deployed processes start without any DDL. For local development,
+# init_db() applies the users migration so `python descope_auth_test.py`
+# works against an empty database.
+USERS_MIGRATION_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations', '002_create_users.sql')
+
 def init_db():
-    conn = None
     try:
-        conn = psycopg2.connect(NEON_DB_URL)
-        cur = conn.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                descope_user_id VARCHAR(255) PRIMARY KEY,
-                email VARCHAR(255) NOT NULL,
-                name VARCHAR(255),
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                last_login_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-        conn.commit()
-        print("Database initialized successfully.")
-    except Exception as e:
-        print(f"Error initializing database: {e}")
-    finally:
-        if conn:
-            conn.close()
-
-# --- CORS Preflight Handling (Updated for multiple origins) ---
-# Essential for cross-origin requests from your frontend. This handles the OPTIONS requests.
-@app.before_request
-def handle_options_requests():
-    if request.method == 'OPTIONS':
-        allowed_origin = get_request_origin()
-        if allowed_origin:
-            response = make_response()
-            response.headers.add('Access-Control-Allow-Origin', allowed_origin)
-            response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-            response.headers.add('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-            response.headers.add('Access-Control-Allow-Credentials', 'true') # Required for cookies
-            return response
-        else:
-            # If the origin is not allowed, return a 403 Forbidden
-            return "CORS origin not allowed.", 403
+        with open(USERS_MIGRATION_PATH) as migration:
+            ddl = migration.read()
+        # The users table may not exist yet, so nothing can be PREPAREd against it
+        with get_db_connection(prepare=False) as conn, conn.cursor() as cur:
+            cur.execute(ddl)
+        log.info("Database initialized successfully.")
+    except Exception:
+        log.exception("Error initializing database")
+
+# --- Error Responses ---
+ERR_NO_SESSION_TOKEN = orjson.dumps({"error": "No session token provided."})
+ERR_DB_OPERATION_FAILED = orjson.dumps({"error": "Database operation failed."})
+ERR_INTERNAL = orjson.dumps({"error": "An internal server error occurred."})
+ERR_AUTH_UNAVAILABLE = orjson.dumps({"error": "Authentication is temporarily unavailable, please try again."})
+ERR_UNAUTHORIZED = orjson.dumps({"error": "Unauthorized"})
+ERR_SESSION_EXPIRED = orjson.dumps({"error": "Session expired, please log in again."})
+ERR_INVALID_SESSION = orjson.dumps({"error": "Invalid session token."})
 
 # --- User Registration / Login (handled by Descope SSO callback) ---
 @app.route('/api/auth/descope-sso-callback', methods=['POST'])
 def sso_callback():
-    allowed_origin = get_request_origin()
-    if not allowed_origin:
-        return "CORS origin not allowed.", 403
-
-    if not descope_client:
-        return jsonify({"error": "Descope client not initialized."}), 500
-
     try:
         data = request.json
         descope_jwt = data.get('sessionToken')
         
         if not descope_jwt:
-            return jsonify({"error": "No session token provided."}), 400
+            return error_response(ERR_NO_SESSION_TOKEN, 400)
 
-        # Validate the Descope JWT
-        validated_token = descope_client.validate_jwt(descope_jwt)
+        # Validate the Descope JWT locally against the cached signing keys
+        validated_token = verify_descope_token(descope_jwt)
         descope_user_id = validated_token['sub']
         user_email = validated_token['email']
         user_name = validated_token.get('name')
 
-        conn = None
         try:
-            conn = psycopg2.connect(NEON_DB_URL)
-            cur = conn.cursor()
-
-            cur.execute("SELECT descope_user_id FROM users WHERE descope_user_id = %s", (descope_user_id,))
-            user = cur.fetchone()
-
-            if user:
-                cur.execute(
-                    "UPDATE users SET last_login_at = CURRENT_TIMESTAMP WHERE descope_user_id = %s",
-                    (descope_user_id,)
-                )
-            else:
-                cur.execute(
-                    "INSERT INTO users (descope_user_id, email, name) VALUES (%s, %s, %s)",
-                    (descope_user_id, user_email, user_name)
-                )
-            
-            conn.commit()
-
-        except Exception as db_error:
-            conn.rollback()
-            print(f"Database error: {db_error}")
-            return jsonify({"error": "Database operation failed."}), 500
-        finally:
-            if conn:
-                conn.close()
+            # One round trip: a single prepared UPSERT records the login
+            with get_db_connection() as conn, conn.cursor() as cur:
+                cur.execute('EXECUTE upsert_user (%s, %s, %s)', (descope_user_id, user_email, user_name))
+
+        except Exception:
+            log.exception("Database error")
+            return error_response(ERR_DB_OPERATION_FAILED, 500)
 
         session_payload = {
             'sub': descope_user_id,
             'email': user_email,
-            'exp': datetime.utcnow() + timedelta(hours=24)
+            'exp': int(time.time()) + SESSION_DURATION_SECONDS
         }
-        session_token = jwt.encode(session_payload, APP_SECRET_KEY, algorithm='HS256')
+        session_token = encode_session_token(session_payload)
         
-        response = jsonify({
+        response = json_response({
             "message": "Login successful",
             "email": user_email,
             "name": user_name
@@ -167,78 +402,57 @@ def sso_callback():
             httponly=True,
             samesite='Lax',
             secure=True,
-            max_age=timedelta(hours=24)
+            max_age=SESSION_DURATION_SECONDS
         )
 
-        response.headers.add('Access-Control-Allow-Origin', allowed_origin)
-        response.headers.add('Access-Control-Allow-Credentials', 'true')
-        
-        return response, 200
+        return response
 
-    except DescopeException as e:
-        print(f"Descope authentication error: {e}")
-        return jsonify({"error": "Authentication failed", "details": str(e)}), 401
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-        return jsonify({"error": "An internal server error occurred."}), 500
+    except jwt.PyJWKClientConnectionError as e:
+        # Not the token's fault: we could not get Descope's signing keys
+        log.warning("Descope authentication unavailable: %s", e)
+        return error_response(ERR_AUTH_UNAVAILABLE, 503)
+    except jwt.PyJWTError as e:
+        # A rejected token is expected traffic, not a server fault: no traceback
+        log.warning("Descope authentication error: %s", e)
+        return json_response({"error": "Authentication failed", "details": str(e)}, 401)
+    except Exception:
+        log.exception("An unexpected error occurred")
+        return error_response(ERR_INTERNAL, 500)
 
 
 # --- Protected Endpoint Example ---
 @app.route('/api/user-data', methods=['GET'])
 def get_user_data():
-    allowed_origin = get_request_origin()
-    if not allowed_origin:
-        return "CORS origin not allowed.", 403
-
     try:
         session_token = request.cookies.get('sessionToken')
         
         if not session_token:
-            return jsonify({"error": "Unauthorized"}), 401
+            return error_response(ERR_UNAUTHORIZED, 401)
         
-        payload = jwt.decode(session_token, APP_SECRET_KEY, algorithms=['HS256'])
+        payload = jwt_decoder.decode(
+            session_token, APP_SECRET_KEY_BYTES, algorithms=SESSION_JWT_ALGORITHMS, options=SESSION_JWT_OPTIONS
+        )
         user_email = payload.get('email')
 
-        response = jsonify({"message": f"Hello, {user_email}! This is protected data."})
-
-        response.headers.add('Access-Control-Allow-Origin', allowed_origin)
-        response.headers.add('Access-Control-Allow-Credentials', 'true')
-        
-        return response, 200
+        return json_response({"message": f"Hello, {user_email}! This is protected data."})
 
     except jwt.ExpiredSignatureError:
-        response = jsonify({"error": "Session expired, please log in again."})
-        response.headers.add('Access-Control-Allow-Origin', allowed_origin)
-        response.headers.add('Access-Control-Allow-Credentials', 'true')
-        return response, 401
+        return error_response(ERR_SESSION_EXPIRED, 401)
     except jwt.InvalidTokenError:
-        response = jsonify({"error": "Invalid session token."})
-        response.headers.add('Access-Control-Allow-Origin', allowed_origin)
-        response.headers.add('Access-Control-Allow-Credentials', 'true')
-        return response, 401
-    except Exception as e:
-        print(f"Error accessing protected endpoint: {e}")
-        response = jsonify({"error": "An internal server error occurred."})
-        response.headers.add('Access-Control-Allow-Origin', allowed_origin)
-        response.headers.add('Access-Control-Allow-Credentials', 'true')
-        return response, 500
+        return error_response(ERR_INVALID_SESSION, 401)
+    except Exception:
+        log.exception("Error accessing protected endpoint")
+        return error_response(ERR_INTERNAL, 500)
 
 
 # --- Logout Endpoint ---
 @app.route('/api/logout', methods=['POST'])
 def logout():
-    allowed_origin = get_request_origin()
-    if not allowed_origin:
-        return "CORS origin not allowed.", 403
-
-    response = jsonify({"message": "Successfully logged out."})
+    response = json_response({"message": "Successfully logged out."})
     
     response.delete_cookie('sessionToken', httponly=True, samesite='Lax', secure=True)
 
-    response.headers.add('Access-Control-Allow-Origin', allowed_origin)
-    response.headers.add('Access-Control-Allow-Credentials', 'true')
-
-    return response, 200
+    return response
 
 
 # --- Health Check (good for Render) ---
@@ -247,7 +461,25 @@ def health_check():
     return "OK", 200
 
 
+# --- Gunicorn Worker Lifecycle ---
+# With preload_app, Gunicorn imports this module once in the master (which also
+# warms the JWKS cache) and forks the workers from it. Sockets and threads must
+# not be shared between processes, so the master closes its pool and stops its
+# JWKS refresher before forking; every worker inherits the cached keys and
+# opens its own pool, HTTP session and refresher (see gunicorn.conf.py).
+def before_fork():
+    stop_jwks_refresher()
+    db.close()
+
+def after_fork():
+    db.open()
+    start_jwks_refresher()
+
+
 # --- Main entry point for Flask app ---
+# Local development only; production runs under Gunicorn (see README.md)
 if __name__ == '__main__':
-    init_db()
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    debug = os.environ.get('FLASK_ENV') == 'development'
+    if debug:
+        init_db()
+    app.run(host='0.0.0.0', port=5000, debug=debug)
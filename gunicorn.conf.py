@@ -0,0 +1,81 @@
+# gunicorn.conf.py
+# Gunicorn picks this file up automatically when started from the project root,
+# e.g. `gunicorn app:app` or `gunicorn descope_auth_test:app`.
+
+import multiprocessing
+import os
+import sys
+
+# Every endpoint spends most of its time waiting on Neon or Descope, so each
+# worker serves requests from a pool of threads: while one request waits on
+# the network, the others keep running. Keep this at or below the database
+# pool size (POOL_MAX_CONNECTIONS) so threads never queue for a connection.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+
+# app.py caches student reads in each process unless CACHE_TYPE names a cache
+# the workers share (e.g. RedisCache). A per-process cache is only correct with
+# a single worker: a write handled by one worker would leave the others serving
+# stale reads.
+CACHE_TYPE = os.environ.get("CACHE_TYPE", "SimpleCache")
+SHARED_CACHE = CACHE_TYPE.rsplit(".", 1)[-1].lower() not in ("simple", "simplecache")
+
+# One worker process per CPU when the cache is shared, otherwise one. Each opens
+# its own database pool, so Neon sees up to workers * PG_POOL_MAX connections.
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() if SHARED_CACHE else 1))
+
+# Hold idle client connections open longer than a typical load balancer
+# (Render's, AWS ALB's: 60s) so it never reuses a socket we just closed.
+keepalive = 65
+
+# GUNICORN_WORKER_CLASS=gevent serves each request from a greenlet instead, so
+# one worker can hold many more requests waiting on I/O. Greenlets that find
+# every pooled database connection in use wait for one to be returned.
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", "1000"))
+
+# Import the app once in the master and fork the workers from it, so startup
+# work (module import, the Descope JWKS prefetch) is not repeated per worker.
+# Not with gevent: it must patch the standard library before the app is imported.
+preload_app = worker_class != "gevent"
+
+
+def _app_module_name(server):
+    # The module named by e.g. "app:app"
+    return server.app.app_uri.split(":")[0]
+
+
+def _app_module(server):
+    # Only already imported when preloaded
+    return sys.modules.get(_app_module_name(server))
+
+
+def on_starting(server):
+    # Refuse, rather than silently serve stale reads from, a WEB_CONCURRENCY or
+    # --workers above 1 without a shared cache. The auth API keeps no such cache.
+    if server.cfg.workers > 1 and not SHARED_CACHE and _app_module_name(server) == "app":
+        raise RuntimeError(
+            f"{server.cfg.workers} workers need a shared cache, but CACHE_TYPE is {CACHE_TYPE}. "
+            "Set CACHE_TYPE=RedisCache and CACHE_REDIS_URL, or run a single worker."
+        )
+
+
+def when_ready(server):
+    # Runs in the master before any worker is forked: a preloaded app releases
+    # the connections and threads that must not be shared with the workers.
+    before_fork = getattr(_app_module(server), "before_fork", None)
+    if before_fork:
+        before_fork()
+
+
+def post_fork(server, worker):
+    # The gevent worker monkey-patches the standard library itself, but psycopg2
+    # talks to Postgres through libpq in C. This makes its waits yield to other
+    # greenlets; it runs before the app (and its connection pool) is imported.
+    if worker_class == "gevent":
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+    # A preloaded app opens this worker's own pool (and JWKS refresher) here
+    after_fork = getattr(_app_module(server), "after_fork", None)
+    if after_fork:
+        after_fork()
@@ -0,0 +1,14 @@
+# json_responses.py
+# JSON response helpers shared by app.py and descope_auth_test.py.
+
+import orjson
+from flask import Response
+
+def json_response(data, status=200):
+    return Response(orjson.dumps(data), status=status, mimetype='application/json')
+
+# Constant error bodies are serialized once at import (with orjson.dumps). Each
+# request still gets its own Response, since Flask-CORS adds per-request
+# headers to it.
+def error_response(body, status):
+    return Response(body, status=status, mimetype='application/json')
@@ -0,0 +1,8 @@
+-- Users who have signed in through Descope (see sso_callback in descope_auth_test.py)
+CREATE TABLE IF NOT EXISTS users (
+    descope_user_id VARCHAR(255) PRIMARY KEY,
+    email VARCHAR(255) NOT NULL,
+    name VARCHAR(255),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    last_login_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
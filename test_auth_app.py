@@ -1,10 +1,16 @@
 # CHQ: Gemini AI generated this file
 
-from flask import Flask, request, jsonify, make_response
+from flask import Flask, request, make_response
 import jwt
-from datetime import datetime, timedelta, timezone
+import orjson
+from datetime import datetime, timezone
 from dotenv import load_dotenv
+import base64
+import hashlib
+import hmac
 import os
+import struct
+import time
 
 # Load environment variables from a .env file
 load_dotenv()
@@ -13,8 +19,62 @@ app = Flask(__name__)
 
 # IMPORTANT: Use a strong, randomly generated secret key from an environment variable.
 # DO NOT hardcode secrets in production.
-# This key is used to sign your own session JWTs.
+# This key is used to sign your own session tokens.
 app.config['SECRET_KEY'] = os.environ.get('JWT_SECRET', 'a_super_secret_key_for_development')
+# Encoded once so signing and verifying use the raw HMAC key bytes directly
+_SECRET = app.config['SECRET_KEY'].encode()
+
+# -----------------------------------------------------------
+# JSON Responses
+# -----------------------------------------------------------
+def json_response(data, status=200):
+    return make_response(orjson.dumps(data), status, {'Content-Type': 'application/json'})
+
+# Constant bodies are serialized once at import. Each request still gets its own
+# response object, since login and logout set cookies on theirs.
+def static_response(body, status=200):
+    return make_response(body, status, {'Content-Type': 'application/json'})
+
+MSG_TOKEN_MISSING = orjson.dumps({'message': 'Descope token missing or malformed'})
+MSG_DESCOPE_INVALID = orjson.dumps({'message': 'Invalid or expired Descope token'})
+MSG_LOGGED_IN = orjson.dumps({'message': 'Logged in successfully'})
+MSG_AUTH_REQUIRED = orjson.dumps({'message': 'Authentication required'})
+MSG_TOKEN_EXPIRED = orjson.dumps({'message': 'Token has expired'})
+MSG_TOKEN_INVALID = orjson.dumps({'message': 'Invalid token'})
+MSG_LOGGED_OUT = orjson.dumps({'message': 'Logged out successfully'})
+
+# -----------------------------------------------------------
+# Session Tokens
+# Our session cookie only needs the user id and an expiry, so it skips the JWT
+# envelope (header JSON, two base64 passes, algorithm negotiation). The token is
+# base64url(exp as 4-byte big-endian | UTF-8 user id | 16-byte HMAC-SHA256 tag).
+# Failures raise PyJWT's exception types so callers handle both token kinds alike.
+# -----------------------------------------------------------
+SESSION_DURATION_SECONDS = 3600
+SESSION_TAG_BYTES = 16
+_SESSION_EXP = struct.Struct('>I')
+
+def _session_tag(payload):
+    return hmac.new(_SECRET, payload, hashlib.sha256).digest()[:SESSION_TAG_BYTES]
+
+def encode_session_token(user_id, exp):
+    payload = _SESSION_EXP.pack(exp) + user_id.encode()
+    return base64.urlsafe_b64encode(payload + _session_tag(payload)).rstrip(b'=').decode()
+
+def verify_session_token(token):
+    """Returns the {'user_id', 'exp'} claims of a valid session token."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+    except ValueError as e:
+        raise jwt.DecodeError("Malformed session token") from e
+    payload, tag = raw[:-SESSION_TAG_BYTES], raw[-SESSION_TAG_BYTES:]
+    # Never compare MACs with ==: compare_digest is constant-time (and runs in C)
+    if len(payload) < _SESSION_EXP.size or not hmac.compare_digest(tag, _session_tag(payload)):
+        raise jwt.InvalidSignatureError("Session token signature verification failed")
+    (exp,) = _SESSION_EXP.unpack_from(payload)
+    if exp <= time.time():
+        raise jwt.ExpiredSignatureError("Session token has expired")
+    return {'user_id': payload[_SESSION_EXP.size:].decode(), 'exp': exp}
 
 # -----------------------------------------------------------
 # Placeholder for Descope Token Verification
@@ -24,7 +84,6 @@ app.config['SECRET_KEY'] = os.environ.get('JWT_SECRET', 'a_super_secret_key_for_
 # -----------------------------------------------------------
 def verify_descope_token(token):
     """Simulates verification of a Descope JWT."""
-    print(f"Attempting to verify Descope token: {token}")
     # In production, you would:
     # 1. Fetch Descope's public keys
     # 2. Use a library like PyJWT to decode and verify the token's signature and claims
@@ -52,37 +111,78 @@ def login():
     # Extract the Descope token from the Authorization header
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'message': 'Descope token missing or malformed'}), 401
+        return static_response(MSG_TOKEN_MISSING, 401)
     
     descope_token = auth_header.split(' ')[1]
 
     # Verify the Descope token with our placeholder function
     user_info = verify_descope_token(descope_token)
     if not user_info:
-        return jsonify({'message': 'Invalid or expired Descope token'}), 401
+        return static_response(MSG_DESCOPE_INVALID, 401)
 
-    # Generate our own, new session JWT for the backend
-    payload = {
-        'user_id': user_info['userId'],
-        'exp': datetime.now(timezone.utc) + timedelta(hours=1) # Token expires in 1 hour
-    }
-    session_token = jwt.encode(payload, app.config['SECRET_KEY'], algorithm='HS256')
+    # Generate our own, new session token for the backend (expires in 1 hour)
+    session_token = encode_session_token(user_info['userId'], int(time.time()) + SESSION_DURATION_SECONDS)
 
     # Create a response object
-    response = make_response(jsonify({'message': 'Logged in successfully'}))
+    response = static_response(MSG_LOGGED_IN)
 
     # Set the HTTP-only cookie
     response.set_cookie(
         'sessionToken',
         session_token,
         httponly=True,  # Crucial: prevents client-side JS from accessing it
-        secure=app.env == 'production', # Only send over HTTPS in production
+        secure=os.environ.get('FLASK_ENV') == 'production', # Only send over HTTPS in production
         samesite='Lax', # Protects against CSRF
-        max_age=3600    # Cookie lifetime in seconds (1 hour)
+        max_age=SESSION_DURATION_SECONDS # Cookie lifetime in seconds (1 hour)
     )
 
     return response
 
+# -----------------------------------------------------------
+# Verified Session Cache
+# The same session cookie is replayed on every request for up to an hour, so
+# the decoded claims are cached under a BLAKE2b hash of the raw token.
+# Each entry carries its own deadline (TTL or token expiry, whichever comes
+# first), so a hit is one dict lookup and one float comparison. A plain dict
+# needs no lock: single get/set/pop/clear calls are atomic under the GIL.
+# -----------------------------------------------------------
+SESSION_CACHE_TTL_SECONDS = 60
+SESSION_CACHE_EXP_MARGIN_SECONDS = 5
+SESSION_CACHE_MAX_ENTRIES = 10_000
+_session_cache = {} # BLAKE2b(token) -> (valid_until, claims)
+
+def session_cache_key(token):
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+def decode_session_token(token):
+    """Returns the verified claims of a session token, raising jwt.InvalidTokenError if invalid."""
+    key = session_cache_key(token)
+    now = time.time()
+    cached = _session_cache.get(key)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+
+    claims = verify_session_token(token)
+    if len(_session_cache) >= SESSION_CACHE_MAX_ENTRIES:
+        # Start over rather than track recency; a miss only costs one HMAC check
+        _session_cache.clear()
+    valid_until = min(claims['exp'] - SESSION_CACHE_EXP_MARGIN_SECONDS, now + SESSION_CACHE_TTL_SECONDS)
+    _session_cache[key] = (valid_until, claims)
+    return claims
+
+# The response's current_time is only resolved to the second, so the ISO string
+# is built once per second rather than once per request.
+_current_time_iso = (0, '')
+
+def current_time_iso():
+    global _current_time_iso
+    now = int(time.time())
+    second, iso = _current_time_iso
+    if second != now:
+        iso = datetime.fromtimestamp(now, timezone.utc).isoformat()
+        _current_time_iso = (now, iso)
+    return iso
+
 # -----------------------------------------------------------
 # 2. Protected Endpoint
 # This endpoint requires an authenticated session. It automatically reads
@@ -94,24 +194,24 @@ def protected_data():
     session_token = request.cookies.get('sessionToken')
     
     if not session_token:
-        return jsonify({'message': 'Authentication required'}), 401
+        return static_response(MSG_AUTH_REQUIRED, 401)
 
     try:
         # Decode and verify the session token using our secret key
-        decoded_token = jwt.decode(session_token, app.config['SECRET_KEY'], algorithms=['HS256'])
+        decoded_token = decode_session_token(session_token)
         
         # The user is authenticated; you can now access their user ID
         user_id = decoded_token['user_id']
         
-        return jsonify({
+        return json_response({
             'message': 'Welcome to the protected resource!',
             'user_id': user_id,
-            'current_time': datetime.now(timezone.utc).isoformat()
-        }), 200
+            'current_time': current_time_iso()
+        })
     except jwt.ExpiredSignatureError:
-        return jsonify({'message': 'Token has expired'}), 403
+        return static_response(MSG_TOKEN_EXPIRED, 403)
     except jwt.InvalidTokenError:
-        return jsonify({'message': 'Invalid token'}), 403
+        return static_response(MSG_TOKEN_INVALID, 403)
 
 # -----------------------------------------------------------
 # 3. Logout Endpoint
@@ -119,7 +219,11 @@ def protected_data():
 # -----------------------------------------------------------
 @app.route('/api/logout', methods=['POST'])
 def logout():
-    response = make_response(jsonify({'message': 'Logged out successfully'}))
+    session_token = request.cookies.get('sessionToken')
+    if session_token:
+        _session_cache.pop(session_cache_key(session_token), None)
+
+    response = static_response(MSG_LOGGED_OUT)
     response.delete_cookie('sessionToken')
     return response
 
@@ -134,4 +238,4 @@ if __name__ == '__main__':
     # For local development, you might set a .env file with JWT_SECRET
     # and run with `flask run`.
     # For production, use a more robust server like Gunicorn or uWSGI.
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    app.run(debug=os.environ.get('FLASK_ENV') == 'development', port=5000)
\ No newline at end of file